@@ -1,30 +1,135 @@
 #!/usr/bin/env python3
+import atexit
+import hashlib
+import logging
 import os
+import re
 import sys
-import json
-import traceback
-from typing import Dict, List, Optional, Union, Generator
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple, Union, Generator
 
-# Immediately check if we can import requests, if not provide clear error
+# Prefer orjson for the (de)serialization hot path, falling back to stdlib json
 try:
-    import requests
+    import orjson
+    
+    _loads = orjson.loads
+    _dumpb = orjson.dumps
+except ImportError:
+    import json
+    
+    _loads = json.loads
+    
+    def _dumpb(obj) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+
+def _emit(obj) -> None:
+    """Write obj to stdout as a single line of UTF-8 JSON"""
+    sys.stdout.buffer.write(_dumpb(obj))
+    sys.stdout.buffer.write(b"\n")
+    sys.stdout.buffer.flush()
+
+# Immediately check if we can import httpx, if not provide clear error
+try:
+    import httpx
 except ImportError:
-    print(json.dumps({
-        "error": "Python requests module not installed. Please install with: python3 -m pip install requests",
-        "answer": "Error: Python requests library not available",
+    _emit({
+        "error": "Python httpx module not installed. Please install with: python3 -m pip install 'httpx[http2]'",
+        "answer": "Error: Python httpx library not available",
         "references": [],
         "simulated": True
-    }))
+    })
     sys.exit(1)
 
-# Print debug message at the start for logging
-print("Python Perplexity client starting...", file=sys.stderr)
+# HTTP/2 needs the optional h2 package; fall back to HTTP/1.1 without it
+try:
+    import h2  # noqa: F401
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
+
+# ijson lets us pull just the message content out of large responses
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Patterns used by extract_references, compiled once at module load
+# The section header is a line of its own and may carry markdown heading or
+# emphasis markup, as in "## References", "**References:**" or "__References__"
+_REF_SECTION_RE = re.compile(
+    r'^[ \t]*(?:#{1,6}[ \t]*|[*_]{1,3})?references\b[*_: \t\r]*\n\s*',
+    re.IGNORECASE | re.MULTILINE
+)
+_REF_KEYWORD_RE = re.compile(r'references', re.IGNORECASE)
+_REF_NUMBER_RE = re.compile(r'^\d+\.\s+')
+_URL_FINDALL_RE = re.compile(r'\bhttps?:\/\/\S+\b', re.IGNORECASE)
+_SENTENCE_SPLIT_RE = re.compile(r'[.!?]\s+')
+
+# Blank line terminating a server-sent event frame
+_SSE_FRAME_END_RE = re.compile(rb'\r?\n\r?\n')
+
+# LRU cache of extract_references results, keyed on a content digest
+_REFERENCES_CACHE: "OrderedDict[bytes, Tuple[List[Dict[str, str]], int]]" = OrderedDict()
+_REFERENCES_CACHE_SIZE = 128
+
+# Shared pooled client so keep-alive avoids a fresh TCP + TLS handshake on
+# every request, and HTTP/2 can multiplex concurrent requests on one connection.
+# The module owns it; it is closed once, at interpreter exit
+_CLIENT: Optional[httpx.Client] = None
+_CLIENT_LOCK = threading.Lock()
+
+def _get_client() -> httpx.Client:
+    """Return the shared HTTP client, creating it on first use"""
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            limits = httpx.Limits(max_connections=20, max_keepalive_connections=10)
+            _CLIENT = httpx.Client(
+                timeout=httpx.Timeout(5.0, read=30.0),
+                transport=httpx.HTTPTransport(http2=_HTTP2, limits=limits, retries=3)
+            )
+        return _CLIENT
+
+@atexit.register
+def _close_client() -> None:
+    """Tear down the shared client's connection pool"""
+    if _CLIENT is not None:
+        _CLIENT.close()
+
+# Diagnostics go to stderr; set PERPLEXITY_DEBUG=1 (or PERPLEXITY_LOG=<level>)
+# to see progress messages
+def _log_level() -> int:
+    """Resolve the log level from the environment, defaulting to WARNING"""
+    if os.environ.get("PERPLEXITY_DEBUG"):
+        return logging.DEBUG
+    
+    name = os.environ.get("PERPLEXITY_LOG", "WARNING").strip().upper()
+    if name.isdigit():
+        return int(name)
+    
+    # getLevelName() maps known names to ints and anything else to a string
+    level = logging.getLevelName(name)
+    return level if isinstance(level, int) else logging.WARNING
+
+log = logging.getLogger("perplexity_client")
+log.setLevel(_log_level())
+log.addHandler(logging.StreamHandler(sys.stderr))
+log.propagate = False
+
+log.debug("Python Perplexity client starting...")
 
 class PerplexityAPI:
     """A client for the Perplexity API."""
     
     BASE_URL = "https://api.perplexity.ai"
     
+    # Transient statuses retried for non-streaming requests
+    RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+    MAX_RETRIES = 3
+    RETRY_BACKOFF = 0.3
+    
     def __init__(self, api_key: Optional[str] = None):
         """
         Initialize the Perplexity API client.
@@ -45,6 +150,9 @@ class PerplexityAPI:
             "content-type": "application/json",
             "Authorization": f"Bearer {self.api_key}"
         }
+        
+        # Pooled client shared by every instance; closed at interpreter exit
+        self.client = _get_client()
     
     def chat_completion(
         self,
@@ -54,7 +162,8 @@ class PerplexityAPI:
         temperature: Optional[float] = None,
         max_tokens: Optional[int] = None,
         top_p: Optional[float] = None,
-    ) -> Union[Dict, Generator]:
+        content_only: bool = False,
+    ) -> Union[Dict, str, Generator]:
         """
         Create a chat completion with the Perplexity API.
         
@@ -65,10 +174,17 @@ class PerplexityAPI:
             temperature: Controls randomness (0-1, lower is more deterministic)
             max_tokens: Maximum number of tokens to generate
             top_p: Controls diversity via nucleus sampling
+            content_only: Return only the first choice's message content,
+                parsed incrementally from the response body
             
         Returns:
-            If stream=False, returns the complete response as a dictionary.
+            If stream=False, returns the complete response as a dictionary,
+            or the message content string if content_only=True.
             If stream=True, returns a generator that yields response chunks.
+        
+        Non-streaming requests that get a 429, 500, 502, 503 or 504 response
+        are retried up to 3 times with exponential backoff (0.3s, 0.6s, 1.2s),
+        or after the server's Retry-After delay if it is longer.
         """
         url = f"{self.BASE_URL}/chat/completions"
         
@@ -91,19 +207,42 @@ class PerplexityAPI:
             return self._stream_response(url, payload)
         else:
             try:
-                print(f"Making request to {url} with model {model}", file=sys.stderr)
-                response = requests.post(url, headers=self.headers, json=payload, timeout=30)
-                print(f"Got response with status: {response.status_code}", file=sys.stderr)
-                
-                if response.status_code != 200:
-                    print(f"Error response: {response.text}", file=sys.stderr)
+                log.debug("Making request to %s with model %s", url, model)
+                for attempt in range(self.MAX_RETRIES + 1):
+                    # Every branch below reads the body to the end before the
+                    # stream context exits; httpx only returns a fully read
+                    # HTTP/1.1 connection to the pool rather than closing it
+                    with self.client.stream("POST", url, headers=self.headers, json=payload) as response:
+                        log.debug("Got response with status: %s", response.status_code)
+                        
+                        if response.status_code != 200:
+                            response.read()
+                            
+                        if response.status_code in self.RETRY_STATUSES and attempt < self.MAX_RETRIES:
+                            delay = self._retry_delay(response, attempt)
+                        else:
+                            if response.status_code != 200:
+                                log.error("Error response: %s", response.text)
+                                
+                            response.raise_for_status()
+                            if content_only:
+                                return extract_content(response.iter_bytes())
+                            return _loads(response.read())
                     
-                response.raise_for_status()
-                return response.json()
-            except requests.exceptions.RequestException as e:
-                print(f"Error making request to Perplexity API: {str(e)}", file=sys.stderr)
+                    log.warning("Got status %s, retrying in %.1fs", response.status_code, delay)
+                    time.sleep(delay)
+            except httpx.HTTPError as e:
+                log.error("Error making request to Perplexity API: %s", e)
                 raise
     
+    def _retry_delay(self, response: httpx.Response, attempt: int) -> float:
+        """Backoff before the next attempt, honouring a numeric Retry-After."""
+        delay = self.RETRY_BACKOFF * (2 ** attempt)
+        retry_after = response.headers.get("retry-after", "")
+        if retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+        return delay
+    
     def _stream_response(self, url: str, payload: Dict) -> Generator:
         """
         Stream the response from the Perplexity API.
@@ -115,69 +254,148 @@ class PerplexityAPI:
         Yields:
             Response chunks as they are received
         """
-        with requests.post(url, headers=self.headers, json=payload, stream=True, timeout=30) as response:
+        with self.client.stream("POST", url, headers=self.headers, json=payload) as response:
             response.raise_for_status()
-            for line in response.iter_lines():
-                if line:
-                    if line.startswith(b"data: "):
-                        chunk = line[6:]  # Remove "data: " prefix
-                        if chunk.strip() != b"[DONE]":
-                            yield chunk.decode("utf-8")
+            
+            # Buffer raw bytes and split on SSE frame boundaries, decoding once
+            # per frame instead of once per line
+            buffer = bytearray()
+            for data in response.iter_bytes(chunk_size=8192):
+                # The unterminated tail was already scanned; only its last
+                # 3 bytes can start a boundary that completes in this chunk
+                scan_from = max(0, len(buffer) - 3)
+                buffer += data
+                start = 0
+                for boundary in _SSE_FRAME_END_RE.finditer(buffer, scan_from):
+                    yield from self._parse_frame(buffer[start:boundary.start()])
+                    start = boundary.end()
+                del buffer[:start]
+            
+            if buffer:
+                yield from self._parse_frame(buffer)
+    
+    @staticmethod
+    def _parse_frame(frame: bytes) -> Generator:
+        """Yield the data payloads of a single SSE frame."""
+        # Split on "\n" only: str.splitlines() would also break on U+2028 and
+        # friends, which JSON allows unescaped inside strings
+        for line in frame.decode("utf-8").split("\n"):
+            line = line.rstrip("\r")
+            if line.startswith("data: "):
+                chunk = line[6:]  # Remove "data: " prefix
+                if chunk.strip() != "[DONE]":
+                    yield chunk
+
+def _warm_client() -> None:
+    """Open a pooled connection to the API ahead of the first real request"""
+    try:
+        _get_client().head(PerplexityAPI.BASE_URL, timeout=2)
+    except httpx.HTTPError:
+        pass
+
+def extract_content(chunks: Iterable[bytes]) -> str:
+    """Extract the first choice's message content from response body chunks"""
+    if ijson is not None:
+        # Parse incrementally and only materialize the content string; the
+        # whole body is still fed through so that close() raises on a
+        # truncated or malformed document
+        found = ijson.sendable_list()
+        parser = ijson.items_coro(found, "choices.item.message.content")
+        for chunk in chunks:
+            parser.send(chunk)
+        parser.close()
+        return found[0] if found else ""
+    
+    response = _loads(b"".join(chunks))
+    return response.get("choices", [{}])[0].get("message", {}).get("content", "")
 
-def extract_references(content):
-    """Extract references from content"""
+def extract_references(content: str) -> Tuple[List[Dict[str, str]], int]:
+    """
+    Extract references from content.
+    
+    Results are memoized on a digest of the content, so repeated identical
+    responses skip the parsing work without the cache holding onto them.
+    
+    Returns:
+        A (references, references_index) tuple, where references_index is the
+        offset of the "References" section header, or -1 if there is none.
+    """
+    # surrogatepass keeps lone surrogates from a stdlib json decode hashable
+    key = hashlib.blake2b(content.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    cached = _REFERENCES_CACHE.get(key)
+    if cached is None:
+        cached = _extract_references(content)
+        _REFERENCES_CACHE[key] = cached
+        if len(_REFERENCES_CACHE) > _REFERENCES_CACHE_SIZE:
+            _REFERENCES_CACHE.popitem(last=False)
+    else:
+        _REFERENCES_CACHE.move_to_end(key)
+    
+    references, references_index = cached
+    return [dict(reference) for reference in references], references_index
+
+def _extract_references(content: str) -> Tuple[List[Dict[str, str]], int]:
+    """Parse references and the references section offset from content"""
     references = []
     
     # Check if there's a "References" section
-    import re
-    references_match = re.search(r'references:?(?:\s*\n)+([\s\S]+)', content, re.IGNORECASE)
+    # Every section match contains the bare keyword, and the keyword-only
+    # pattern scans much faster than the full header pattern, so use it to
+    # rule out responses without a section
+    references_match = None
+    if _REF_KEYWORD_RE.search(content):
+        references_match = _REF_SECTION_RE.search(content)
+    references_index = references_match.start() if references_match else -1
     
-    if references_match and references_match.group(1):
-        references_text = references_match.group(1).strip()
-        reference_lines = references_text.split('\n')
+    # Slice the section body rather than capturing it, so the regex stops at
+    # the header instead of running to the end of the content
+    references_text = content[references_match.end():] if references_match else ""
+    if references_text:
         
-        for line in reference_lines:
-            if not line.strip():
+        # Single pass over stripped, non-blank lines
+        for line in filter(None, map(str.strip, references_text.splitlines())):
+            # Locate the URL first, then split the text before it on literal
+            # separators rather than using a backtracking-prone regex
+            url_match = _URL_FINDALL_RE.search(line)
+            if not url_match:
                 continue
-                
-            # Match numbered references like "1. Title - snippet - url"
-            match = re.match(r'^\d+\.\s+(.+?)(?:\s+-\s+|\s*\n\s*)(.+?)(?:\s+-\s+|\s*\n\s*)(https?:\/\/\S+)\b', line, re.IGNORECASE)
             
-            if match:
-                references.append({
-                    "title": match.group(1).strip(),
-                    "snippet": match.group(2).strip(),
-                    "url": match.group(3).strip()
-                })
-                continue
+            url = url_match.group(0)
+            prefix = line[:url_match.start()]
+            
+            # Match numbered references like "1. Title - snippet - url"
+            number_match = _REF_NUMBER_RE.match(prefix)
+            if number_match:
+                parts = prefix[number_match.end():].rstrip(' -').split(' - ', 1)
+                if len(parts) == 2 and parts[0].strip() and parts[1].strip():
+                    references.append({
+                        "title": parts[0].strip(),
+                        "snippet": parts[1].strip(),
+                        "url": url
+                    })
+                    continue
             
-            # If not matched, try to extract just the URL and use the text before it as title/snippet
-            url_match = re.match(r'^(.*?)(https?:\/\/\S+)\b', line, re.IGNORECASE)
+            # If not matched, use the text before the URL as title/snippet
+            remaining_text = prefix.strip()
+            split_index = len(remaining_text) // 2
             
-            if url_match and url_match.group(2):
-                remaining_text = url_match.group(1).strip()
-                split_index = len(remaining_text) // 2
-                
-                references.append({
-                    "title": remaining_text[:split_index].strip() or "Reference",
-                    "snippet": remaining_text[split_index:].strip() or "No snippet available",
-                    "url": url_match.group(2)
-                })
+            references.append({
+                "title": remaining_text[:split_index].strip() or "Reference",
+                "snippet": remaining_text[split_index:].strip() or "No snippet available",
+                "url": url
+            })
     
     # If no references were found using the structured approach, try a fallback regex pattern
     if not references:
-        # Look for URLs in the content
-        url_regex = r'\bhttps?:\/\/\S+\b'
-        urls = re.findall(url_regex, content, re.IGNORECASE)
-        
-        # For each URL, extract surrounding text as title and snippet
-        for url in urls:
-            # Find where the URL occurs in the content
-            url_index = content.find(url)
+        # Scan the content once, extracting surrounding text for each URL
+        # occurrence as title and snippet
+        for url_match in _URL_FINDALL_RE.finditer(content):
+            url = url_match.group(0)
+            url_index = url_match.start()
             surrounding_text = content[max(0, url_index - 150):url_index].strip()
             
             # Use the last sentence fragment before the URL as the title
-            sentence_parts = re.split(r'[.!?]\s+', surrounding_text)
+            sentence_parts = _SENTENCE_SPLIT_RE.split(surrounding_text)
             title = sentence_parts[-1] if sentence_parts else "Reference"
             
             references.append({
@@ -186,15 +404,12 @@ def extract_references(content):
                 "url": url
             })
     
-    return references
+    return references, references_index
 
 def perform_research(query, api_key, model="sonar-deep-research"):
     """Perform research using Perplexity API and return formatted results"""
     try:
-        print(f"Performing research for query: {query} with model: {model}", file=sys.stderr)
-        
-        # Initialize the API client
-        perplexity = PerplexityAPI(api_key)
+        log.debug("Performing research for query: %s with model: %s", query, model)
         
         # Create messages for the research query
         messages = [
@@ -208,22 +423,21 @@ def perform_research(query, api_key, model="sonar-deep-research"):
             }
         ]
         
-        # Make the API request
-        print("Sending request to Perplexity API...", file=sys.stderr)
-        response = perplexity.chat_completion(messages=messages, model=model)
-        print("Received response from Perplexity API", file=sys.stderr)
+        # Initialize the API client
+        perplexity = PerplexityAPI(api_key)
         
-        # Extract content from response
-        content = response.get("choices", [{}])[0].get("message", {}).get("content", "")
-        print(f"Extracted content length: {len(content)}", file=sys.stderr)
+        # Make the API request
+        log.debug("Sending request to Perplexity API...")
+        content = perplexity.chat_completion(messages=messages, model=model, content_only=True)
+        log.debug("Received response from Perplexity API")
+        log.debug("Extracted content length: %d", len(content))
         
         # Parse the content to extract references
-        references = extract_references(content)
-        print(f"Extracted {len(references)} references", file=sys.stderr)
+        references, references_index = extract_references(content)
+        log.debug("Extracted %d references", len(references))
         
         # Remove the references section from the answer
         answer = content
-        references_index = content.lower().find("references")
         if references_index != -1:
             answer = content[:references_index].strip()
         
@@ -233,11 +447,10 @@ def perform_research(query, api_key, model="sonar-deep-research"):
             "simulated": False
         }
         
-        print("Research completed successfully", file=sys.stderr)
+        log.debug("Research completed successfully")
         return result
     except Exception as e:
-        print(f"Error in perform_research: {str(e)}", file=sys.stderr)
-        print(f"Traceback: {traceback.format_exc()}", file=sys.stderr)
+        log.exception("Error in perform_research: %s", e)
         # Return error information
         return {
             "error": str(e),
@@ -248,41 +461,44 @@ def perform_research(query, api_key, model="sonar-deep-research"):
 
 # Main handler for when script is called directly
 if __name__ == "__main__":
+    # Overlap the TCP + TLS handshake with input parsing
+    threading.Thread(target=_warm_client, daemon=True).start()
+    
     # Check if input is provided
-    print(f"Python script started with {len(sys.argv)} arguments", file=sys.stderr)
+    log.debug("Python script started with %d arguments", len(sys.argv))
     
     if len(sys.argv) < 2:
-        print("Error: No input provided", file=sys.stderr)
-        print(json.dumps({
+        log.error("Error: No input provided")
+        _emit({
             "error": "No input provided to Python script",
             "answer": "Error: No input provided to Python script",
             "references": [],
             "simulated": True
-        }))
+        })
         sys.exit(1)
     
     try:
         # Parse input from command line argument
-        print(f"Parsing input: {sys.argv[1][:100]}...", file=sys.stderr)
-        input_data = json.loads(sys.argv[1])
+        log.debug("Parsing input: %.100s...", sys.argv[1])
+        input_data = _loads(sys.argv[1])
         query = input_data.get("query")
         api_key = input_data.get("apiKey")
         model = input_data.get("model", "sonar-deep-research")
         
-        print(f"Parsed input - Query: {query}, API Key provided: {bool(api_key)}, Model: {model}", file=sys.stderr)
+        log.debug("Parsed input - Query: %s, API Key provided: %s, Model: %s", query, bool(api_key), model)
         
         if not query:
-            print("Error: No query provided", file=sys.stderr)
-            print(json.dumps({
+            log.error("Error: No query provided")
+            _emit({
                 "error": "No query provided",
                 "answer": "Error: No query provided to Python script",
                 "references": [],
                 "simulated": True
-            }))
+            })
             sys.exit(1)
         
         if not api_key:
-            print("Error: No API key provided", file=sys.stderr)
+            log.warning("No API key provided, returning simulated response")
             # Return simulated response
             result = {
                 "answer": f"Simulated response for: {query}",
@@ -301,16 +517,14 @@ if __name__ == "__main__":
             result = perform_research(query, api_key, model)
         
         # Output result as JSON
-        output = json.dumps(result)
-        print(output)
+        _emit(result)
         
     except Exception as e:
-        print(f"Unexpected error in Python script: {str(e)}", file=sys.stderr)
-        print(f"Traceback: {traceback.format_exc()}", file=sys.stderr)
-        print(json.dumps({
+        log.exception("Unexpected error in Python script: %s", e)
+        _emit({
             "error": f"Unexpected error in Python script: {str(e)}",
             "answer": f"Error in Python script: {str(e)}",
             "references": [],
             "simulated": True
-        }))
+        })
         sys.exit(1) 
\ No newline at end of file